@@ -11,30 +11,86 @@ Urban University Platform - Полная система управления с
 - Просмотр профилей студентов
 """
 
-from flask import Flask, render_template_string, request, redirect, url_for, session, jsonify, send_file
+from flask import Flask, Request, g, render_template, request, redirect, url_for, session, jsonify, send_file
 from flask_socketio import SocketIO, emit
+from jinja2 import DictLoader
+from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 import hashlib
+import hmac
 import secrets
-from datetime import datetime, timedelta
 import os
+import queue
+import threading
 import time
 import base64
+import functools
+import gzip
+import re
 from PIL import Image
 import io
-import random
 import string
+import textwrap
 import qrcode
 
+# Максимальный размер запроса
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+# Загрузки до этого размера держим в памяти, крупнее — во временном файле (у Werkzeug порог 500 КБ)
+UPLOAD_MEMORY_LIMIT = 1024 * 1024
+
+class UploadRequest(Request):
+    """Запрос, который не сбрасывает небольшие загрузки во временный файл"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_MEMORY_LIMIT:
+            return io.BytesIO()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(32)
+app.request_class = UploadRequest
+# Общий ключ нужен, когда приложение запущено в нескольких процессах
+app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
+app.json.sort_keys = False
+app.json.compact = True
 socketio = SocketIO(app, cors_allowed_origins="*")
 
 # =============== DATABASE INITIALIZATION ===============
 
+DATABASE = 'urban_community.db'
+DB_POOL_SIZE = 16
+DB_STATEMENT_CACHE_SIZE = 256
+
+# Пул соединений: подготовленные запросы кэшируются в соединении и
+# переиспользуются между запросами, а не компилируются заново каждый раз
+_db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+def get_db():
+    """Соединение с базой данных, общее для всего текущего запроса"""
+    if 'db' not in g:
+        try:
+            g.db = _db_pool.get_nowait()
+        except queue.Empty:
+            g.db = sqlite3.connect(DATABASE, check_same_thread=False,
+                                   cached_statements=DB_STATEMENT_CACHE_SIZE)
+            # В режиме WAL NORMAL безопасен и не делает fsync на каждый коммит
+            g.db.execute('PRAGMA synchronous=NORMAL')
+    return g.db
+
+@app.teardown_appcontext
+def close_db(exception):
+    db = g.pop('db', None)
+    if db is None:
+        return
+    db.rollback()
+    try:
+        _db_pool.put_nowait(db)
+    except queue.Full:
+        db.close()
+
 def init_db():
     """Инициализация базы данных с улучшенной структурой"""
-    conn = sqlite3.connect('urban_community.db')
+    conn = sqlite3.connect(DATABASE)
     c = conn.cursor()
     
     # Users table
@@ -105,35 +161,71 @@ def init_db():
                   FOREIGN KEY (user_id) REFERENCES users (id),
                   FOREIGN KEY (item_id) REFERENCES shop_items (id))''')
     
+    # Indexes
+    c.execute('CREATE INDEX IF NOT EXISTS idx_scans_user_event ON scans (user_id, event_id)')
+    # Составные индексы под фильтр + сортировку горячих списков: выборка идет по индексу без сортировки
+    c.execute('CREATE INDEX IF NOT EXISTS idx_scans_user_exit ON scans (user_id, exit_time)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_scans_event_created ON scans (event_id, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_purchases_user_created ON purchases (user_id, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_purchases_status_created ON purchases (status, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_events_creator_created ON events (creator_id, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_full_name ON users (full_name)')
+    
+    # WAL: читатели не блокируют запись, коммит не переписывает весь журнал
+    c.execute('PRAGMA journal_mode=WAL')
+    
     conn.commit()
     conn.close()
 
 def hash_password(password):
-    """Хеширование пароля"""
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def generate_time_based_qr(event_id):
+    """Хеширование пароля (соль + KDF)"""
+    return generate_password_hash(password)
+
+# Хеш-заглушка: для несуществующего логина выполняется та же KDF-проверка,
+# чтобы по времени ответа нельзя было перебирать имена пользователей
+_DUMMY_PASSWORD_HASH = generate_password_hash(secrets.token_hex(16))
+
+def verify_password(password_hash, password):
+    """Проверка пароля за постоянное время, включая старые SHA-256 хеши и отсутствующего пользователя"""
+    if password_hash is not None and '$' in password_hash:
+        return check_password_hash(password_hash, password)
+    # Нет пользователя или старый хеш: KDF все равно считается, время ответа одинаковое
+    check_password_hash(_DUMMY_PASSWORD_HASH, password)
+    if password_hash is None:
+        return False
+    legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+    return hmac.compare_digest(legacy_hash, password_hash)
+
+def is_legacy_hash(password_hash):
+    """Хеш сохранён старым способом (SHA-256 без соли)"""
+    return '$' not in password_hash
+
+def generate_time_based_qr(event_id, minute=None):
     """Генерация 4-символьного QR-кода, который меняется каждую минуту"""
-    current_minute = int(time.time() // 60)
+    current_minute = int(time.time() // 60) if minute is None else minute
     seed = f"{event_id}-exit-{current_minute}"
     hash_obj = hashlib.md5(seed.encode())
     code = hash_obj.hexdigest()[:4].upper()
     return code
 
+def qr_expires_in(now):
+    """Сколько секунд осталось до смены QR-кода"""
+    return 60 - int(now) % 60
+
+PURCHASE_CODE_ALPHABET = string.ascii_uppercase + string.digits
+
 def generate_purchase_code():
     """Генерация уникального 6-символьного кода для покупки"""
+    c = get_db().cursor()
     while True:
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        conn = sqlite3.connect('urban_community.db')
-        c = conn.cursor()
+        code = ''.join(secrets.choice(PURCHASE_CODE_ALPHABET) for _ in range(6))
         c.execute('SELECT id FROM purchases WHERE code = ?', (code,))
         if not c.fetchone():
-            conn.close()
             return code
-        conn.close()
 
+@functools.lru_cache(maxsize=256)
 def generate_qr_image(data):
-    """Генерация QR-кода в виде base64 изображения"""
+    """Генерация QR-кода в виде base64 изображения (кэшируется по содержимому)"""
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_H,
@@ -147,690 +239,32 @@ def generate_qr_image(data):
     
     buffer = io.BytesIO()
     img.save(buffer, format='PNG')
-    buffer.seek(0)
     
-    image_data = base64.b64encode(buffer.read()).decode('utf-8')
+    image_data = base64.b64encode(buffer.getbuffer()).decode('utf-8')
     return f'data:image/png;base64,{image_data}'
 
-# =============== ENHANCED MODERN UI STYLES ===============
+# Не больше стольких изображений декодируется одновременно, чтобы
+# параллельные загрузки не конкурировали за CPU и память
+_image_slots = threading.BoundedSemaphore(min(8, (os.cpu_count() or 1) * 2))
 
-MODERN_STYLES = """
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800;900&display=swap');
-    
-    * {
-        margin: 0;
-        padding: 0;
-        box-sizing: border-box;
-    }
-    
-    :root {
-        --primary: #6366f1;
-        --primary-dark: #4f46e5;
-        --primary-light: #818cf8;
-        --secondary: #8b5cf6;
-        --accent: #ec4899;
-        --success: #10b981;
-        --warning: #f59e0b;
-        --danger: #ef4444;
-        --dark: #1e293b;
-        --light: #f8fafc;
-        --gray: #64748b;
-        --border: #e2e8f0;
-        --shadow: rgba(0, 0, 0, 0.1);
-        --shadow-lg: rgba(0, 0, 0, 0.15);
-    }
-    
-    body {
-        font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 50%, #f093fb 100%);
-        background-attachment: fixed;
-        min-height: 100vh;
-        padding: 15px;
-        line-height: 1.6;
-        color: var(--dark);
-        -webkit-font-smoothing: antialiased;
-        -moz-osx-font-smoothing: grayscale;
-    }
-    
-    .container {
-        max-width: 1400px;
-        margin: 0 auto;
-        animation: fadeIn 0.5s ease-in;
-    }
-    
-    @keyframes fadeIn {
-        from { opacity: 0; transform: translateY(20px); }
-        to { opacity: 1; transform: translateY(0); }
-    }
-    
-    @keyframes slideIn {
-        from { opacity: 0; transform: translateX(-20px); }
-        to { opacity: 1; transform: translateX(0); }
-    }
-    
-    @keyframes scaleIn {
-        from { opacity: 0; transform: scale(0.9); }
-        to { opacity: 1; transform: scale(1); }
-    }
-    
-    .card {
-        background: rgba(255, 255, 255, 0.98);
-        border-radius: 24px;
-        padding: 35px;
-        box-shadow: 0 25px 50px -12px rgba(0, 0, 0, 0.25);
-        backdrop-filter: blur(20px);
-        margin-bottom: 25px;
-        border: 1px solid rgba(255, 255, 255, 0.3);
-        transition: all 0.3s cubic-bezier(0.4, 0, 0.2, 1);
-        animation: scaleIn 0.4s ease-out;
-    }
-    
-    .card:hover {
-        transform: translateY(-5px);
-        box-shadow: 0 30px 60px -15px rgba(0, 0, 0, 0.3);
-    }
-    
-    .header {
-        display: flex;
-        justify-content: space-between;
-        align-items: center;
-        margin-bottom: 35px;
-        flex-wrap: wrap;
-        gap: 20px;
-        animation: slideIn 0.5s ease-out;
-    }
-    
-    h1 {
-        background: linear-gradient(135deg, var(--primary) 0%, var(--secondary) 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-        font-size: clamp(2rem, 5vw, 3rem);
-        font-weight: 800;
-        letter-spacing: -0.02em;
-        line-height: 1.2;
-    }
-    
-    h2 {
-        color: var(--primary);
-        font-size: clamp(1.5rem, 3vw, 2rem);
-        font-weight: 700;
-        margin-bottom: 25px;
-        letter-spacing: -0.01em;
-    }
-    
-    h3 {
-        color: var(--dark);
-        font-size: clamp(1.2rem, 2.5vw, 1.5rem);
-        font-weight: 600;
-        margin-bottom: 15px;
-    }
-    
-    .btn {
-        padding: 14px 32px;
-        border: none;
-        border-radius: 12px;
-        font-size: 16px;
-        font-weight: 600;
-        cursor: pointer;
-        transition: all 0.3s cubic-bezier(0.4, 0, 0.2, 1);
-        text-decoration: none;
-        display: inline-flex;
-        align-items: center;
-        justify-content: center;
-        gap: 8px;
-        position: relative;
-        overflow: hidden;
-        white-space: nowrap;
-    }
-    
-    .btn::before {
-        content: '';
-        position: absolute;
-        top: 50%;
-        left: 50%;
-        width: 0;
-        height: 0;
-        border-radius: 50%;
-        background: rgba(255, 255, 255, 0.3);
-        transform: translate(-50%, -50%);
-        transition: width 0.6s, height 0.6s;
-    }
-    
-    .btn:hover::before {
-        width: 300px;
-        height: 300px;
-    }
-    
-    .btn > * {
-        position: relative;
-        z-index: 1;
-    }
-    
-    .btn-primary {
-        background: linear-gradient(135deg, var(--primary) 0%, var(--secondary) 100%);
-        color: white;
-        box-shadow: 0 10px 25px -5px rgba(99, 102, 241, 0.4);
-    }
-    
-    .btn-primary:hover {
-        transform: translateY(-3px);
-        box-shadow: 0 15px 35px -5px rgba(99, 102, 241, 0.5);
-    }
-    
-    .btn-primary:active {
-        transform: translateY(-1px);
-    }
-    
-    .btn-secondary {
-        background: var(--light);
-        color: var(--dark);
-        border: 2px solid var(--border);
-    }
-    
-    .btn-secondary:hover {
-        background: white;
-        border-color: var(--primary);
-        color: var(--primary);
-        transform: translateY(-2px);
-    }
-    
-    .btn-danger {
-        background: linear-gradient(135deg, #ef4444 0%, #dc2626 100%);
-        color: white;
-        box-shadow: 0 10px 25px -5px rgba(239, 68, 68, 0.4);
-    }
-    
-    .btn-danger:hover {
-        transform: translateY(-3px);
-        box-shadow: 0 15px 35px -5px rgba(239, 68, 68, 0.5);
-    }
-    
-    .btn-success {
-        background: linear-gradient(135deg, #10b981 0%, #059669 100%);
-        color: white;
-        box-shadow: 0 10px 25px -5px rgba(16, 185, 129, 0.4);
-    }
-    
-    .btn-success:hover {
-        transform: translateY(-3px);
-        box-shadow: 0 15px 35px -5px rgba(16, 185, 129, 0.5);
-    }
-    
-    input, select, textarea {
-        width: 100%;
-        padding: 16px 20px;
-        border: 2px solid var(--border);
-        border-radius: 12px;
-        font-size: 16px;
-        font-family: inherit;
-        margin-bottom: 18px;
-        transition: all 0.3s ease;
-        background: white;
-    }
-    
-    input:focus, select:focus, textarea:focus {
-        outline: none;
-        border-color: var(--primary);
-        box-shadow: 0 0 0 4px rgba(99, 102, 241, 0.1);
-        transform: translateY(-2px);
-    }
-    
-    input::placeholder {
-        color: var(--gray);
-    }
-    
-    label {
-        display: block;
-        font-weight: 600;
-        margin-bottom: 10px;
-        color: var(--dark);
-        font-size: 15px;
-    }
-    
-    .alert {
-        padding: 18px 24px;
-        border-radius: 12px;
-        margin-bottom: 25px;
-        font-weight: 500;
-        display: flex;
-        align-items: center;
-        gap: 12px;
-        animation: slideIn 0.4s ease-out;
-    }
-    
-    .alert::before {
-        font-size: 24px;
-    }
-    
-    .alert-success {
-        background: linear-gradient(135deg, #d1fae5 0%, #a7f3d0 100%);
-        color: #065f46;
-        border: 2px solid #6ee7b7;
-    }
-    
-    .alert-success::before {
-        content: '✅';
-    }
-    
-    .alert-error {
-        background: linear-gradient(135deg, #fee2e2 0%, #fecaca 100%);
-        color: #991b1b;
-        border: 2px solid #fca5a5;
-    }
-    
-    .alert-error::before {
-        content: '❌';
-    }
-    
-    .grid {
-        display: grid;
-        gap: 25px;
-    }
-    
-    .grid-2 {
-        grid-template-columns: repeat(auto-fit, minmax(min(100%, 320px), 1fr));
-    }
-    
-    .grid-3 {
-        grid-template-columns: repeat(auto-fit, minmax(min(100%, 280px), 1fr));
-    }
-    
-    .grid-4 {
-        grid-template-columns: repeat(auto-fit, minmax(min(100%, 220px), 1fr));
-    }
-    
-    .stat-card {
-        background: linear-gradient(135deg, var(--primary) 0%, var(--secondary) 100%);
-        color: white;
-        padding: 30px;
-        border-radius: 20px;
-        text-align: center;
-        box-shadow: 0 20px 40px -10px rgba(99, 102, 241, 0.4);
-        transition: all 0.3s ease;
-        position: relative;
-        overflow: hidden;
-    }
-    
-    .stat-card::before {
-        content: '';
-        position: absolute;
-        top: -50%;
-        right: -50%;
-        width: 200%;
-        height: 200%;
-        background: radial-gradient(circle, rgba(255,255,255,0.1) 0%, transparent 70%);
-        animation: rotate 20s linear infinite;
-    }
-    
-    @keyframes rotate {
-        from { transform: rotate(0deg); }
-        to { transform: rotate(360deg); }
-    }
-    
-    .stat-card:hover {
-        transform: translateY(-8px) scale(1.02);
-        box-shadow: 0 25px 50px -10px rgba(99, 102, 241, 0.5);
-    }
-    
-    .stat-number {
-        font-size: clamp(2.5rem, 6vw, 4rem);
-        font-weight: 800;
-        margin: 15px 0;
-        position: relative;
-        z-index: 1;
-        text-shadow: 0 2px 10px rgba(0, 0, 0, 0.2);
-    }
-    
-    .stat-label {
-        font-size: clamp(1rem, 2vw, 1.3rem);
-        opacity: 0.95;
-        font-weight: 600;
-        position: relative;
-        z-index: 1;
-    }
-    
-    table {
-        width: 100%;
-        border-collapse: separate;
-        border-spacing: 0;
-        margin-top: 25px;
-        overflow: hidden;
-        border-radius: 12px;
-        box-shadow: 0 4px 6px -1px var(--shadow);
-    }
-    
-    th, td {
-        padding: 18px 20px;
-        text-align: left;
-        border-bottom: 1px solid var(--border);
-    }
-    
-    th {
-        background: linear-gradient(135deg, #f8fafc 0%, #f1f5f9 100%);
-        font-weight: 700;
-        color: var(--primary);
-        text-transform: uppercase;
-        font-size: 13px;
-        letter-spacing: 0.05em;
-        cursor: pointer;
-        user-select: none;
-        position: sticky;
-        top: 0;
-        z-index: 10;
-    }
-    
-    th:hover {
-        background: linear-gradient(135deg, #f1f5f9 0%, #e2e8f0 100%);
-    }
-    
-    tbody tr {
-        transition: all 0.2s ease;
-        background: white;
-    }
-    
-    tbody tr:hover {
-        background: linear-gradient(135deg, #f8fafc 0%, #f1f5f9 100%);
-        transform: scale(1.01);
-        box-shadow: 0 4px 12px -2px var(--shadow);
-    }
-    
-    tbody tr:last-child td {
-        border-bottom: none;
-    }
-    
-    /* QR Code Styles */
-    .qr-container {
-        text-align: center;
-        padding: 30px;
-        background: white;
-        border-radius: 20px;
-        cursor: pointer;
-        transition: all 0.3s ease;
-        box-shadow: 0 10px 30px -5px var(--shadow);
-    }
-    
-    .qr-container:hover {
-        transform: scale(1.05);
-        box-shadow: 0 20px 40px -5px var(--shadow-lg);
-    }
-    
-    .qr-code-img {
-        max-width: 350px;
-        width: 100%;
-        height: auto;
-        border-radius: 15px;
-        box-shadow: 0 8px 20px -5px var(--shadow);
-    }
-    
-    .modal {
-        display: none;
-        position: fixed;
-        z-index: 9999;
-        left: 0;
-        top: 0;
-        width: 100%;
-        height: 100%;
-        background: rgba(0, 0, 0, 0.85);
-        backdrop-filter: blur(10px);
-        justify-content: center;
-        align-items: center;
-        animation: fadeIn 0.3s ease;
-    }
-    
-    .modal.active {
-        display: flex;
-    }
-    
-    .modal-content {
-        background: white;
-        padding: 40px;
-        border-radius: 24px;
-        max-width: 90%;
-        max-height: 90%;
-        position: relative;
-        animation: scaleIn 0.3s ease-out;
-        box-shadow: 0 25px 50px -12px rgba(0, 0, 0, 0.5);
-    }
-    
-    .modal-close {
-        position: absolute;
-        top: 15px;
-        right: 25px;
-        font-size: 36px;
-        cursor: pointer;
-        color: var(--gray);
-        transition: all 0.2s ease;
-        width: 40px;
-        height: 40px;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        border-radius: 50%;
-    }
-    
-    .modal-close:hover {
-        color: var(--danger);
-        background: var(--light);
-        transform: rotate(90deg);
-    }
-    
-    .modal-qr {
-        max-width: 700px;
-        width: 100%;
-    }
-    
-    /* Filter Styles */
-    .filter-bar {
-        display: flex;
-        gap: 18px;
-        margin-bottom: 25px;
-        flex-wrap: wrap;
-    }
-    
-    .filter-bar input,
-    .filter-bar select {
-        flex: 1;
-        min-width: 220px;
-        margin-bottom: 0;
-    }
-    
-    .student-row {
-        cursor: pointer;
-    }
-    
-    .badge {
-        display: inline-flex;
-        align-items: center;
-        gap: 6px;
-        padding: 6px 14px;
-        border-radius: 20px;
-        font-size: 13px;
-        font-weight: 600;
-        letter-spacing: 0.02em;
-    }
-    
-    .badge-success {
-        background: linear-gradient(135deg, #d1fae5 0%, #a7f3d0 100%);
-        color: #065f46;
-    }
-    
-    .badge-warning {
-        background: linear-gradient(135deg, #fef3c7 0%, #fde68a 100%);
-        color: #92400e;
-    }
-    
-    .badge-info {
-        background: linear-gradient(135deg, #dbeafe 0%, #bfdbfe 100%);
-        color: #1e40af;
-    }
-    
-    .progress-bar {
-        width: 100%;
-        height: 35px;
-        background: var(--light);
-        border-radius: 20px;
-        overflow: hidden;
-        margin: 15px 0;
-        box-shadow: inset 0 2px 4px var(--shadow);
-    }
-    
-    .progress-fill {
-        height: 100%;
-        background: linear-gradient(90deg, var(--primary) 0%, var(--secondary) 100%);
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        color: white;
-        font-weight: 700;
-        font-size: 15px;
-        transition: width 0.8s cubic-bezier(0.4, 0, 0.2, 1);
-        box-shadow: 0 2px 10px rgba(99, 102, 241, 0.4);
-    }
-    
-    .chart-container {
-        background: white;
-        padding: 25px;
-        border-radius: 20px;
-        margin: 25px 0;
-        box-shadow: 0 4px 6px -1px var(--shadow);
-    }
-    
-    /* Responsive Design */
-    @media (max-width: 768px) {
-        body {
-            padding: 10px;
-        }
-        
-        .card {
-            padding: 25px 20px;
-            border-radius: 20px;
-        }
-        
-        .header {
-            flex-direction: column;
-            align-items: flex-start;
-        }
-        
-        h1 {
-            font-size: 2rem;
-        }
-        
-        .btn {
-            width: 100%;
-            padding: 16px 24px;
-        }
-        
-        .grid-2, .grid-3, .grid-4 {
-            grid-template-columns: 1fr;
-        }
-        
-        table {
-            font-size: 14px;
-        }
-        
-        th, td {
-            padding: 12px 10px;
-        }
-        
-        .stat-number {
-            font-size: 3rem;
-        }
-        
-        .filter-bar {
-            flex-direction: column;
-        }
-        
-        .filter-bar input,
-        .filter-bar select {
-            width: 100%;
-            min-width: 100%;
-        }
-    }
-    
-    @media (max-width: 480px) {
-        .modal-content {
-            padding: 25px;
-            max-width: 95%;
-        }
+def image_to_data_url(file, size):
+    """Уменьшение загруженного изображения и перевод в JPEG data URL"""
+    with _image_slots:
+        image = Image.open(file.stream)
+        # JPEG декодируется сразу в уменьшенном масштабе, а не в полном разрешении;
+        # для остальных форматов draft() ничего не делает
+        image.draft('RGB', size)
+        image = image.convert('RGB')
+        image.thumbnail(size)
         
-        .qr-code-img {
-            max-width: 250px;
-        }
-    }
-    
-    /* Loading Animation */
-    .loading {
-        display: inline-block;
-        width: 20px;
-        height: 20px;
-        border: 3px solid rgba(255, 255, 255, 0.3);
-        border-radius: 50%;
-        border-top-color: white;
-        animation: spin 0.8s linear infinite;
-    }
-    
-    @keyframes spin {
-        to { transform: rotate(360deg); }
-    }
-    
-    /* Smooth Scrollbar */
-    ::-webkit-scrollbar {
-        width: 12px;
-        height: 12px;
-    }
-    
-    ::-webkit-scrollbar-track {
-        background: var(--light);
-        border-radius: 10px;
-    }
-    
-    ::-webkit-scrollbar-thumb {
-        background: linear-gradient(135deg, var(--primary) 0%, var(--secondary) 100%);
-        border-radius: 10px;
-        border: 2px solid var(--light);
-    }
-    
-    ::-webkit-scrollbar-thumb:hover {
-        background: linear-gradient(135deg, var(--primary-dark) 0%, var(--secondary) 100%);
-    }
-    
-    /* Link Styles */
-    a {
-        color: var(--primary);
-        text-decoration: none;
-        font-weight: 600;
-        transition: all 0.2s ease;
-    }
-    
-    a:hover {
-        color: var(--secondary);
-        text-decoration: underline;
-    }
-    
-    /* Form Styles */
-    form {
-        animation: fadeIn 0.5s ease-out;
-    }
-    
-    /* Utility Classes */
-    .text-center {
-        text-align: center;
-    }
-    
-    .mt-1 { margin-top: 10px; }
-    .mt-2 { margin-top: 20px; }
-    .mt-3 { margin-top: 30px; }
-    .mb-1 { margin-bottom: 10px; }
-    .mb-2 { margin-bottom: 20px; }
-    .mb-3 { margin-bottom: 30px; }
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=85)
     
-    .p-1 { padding: 10px; }
-    .p-2 { padding: 20px; }
-    .p-3 { padding: 30px; }
-</style>
-"""
+    image_data = base64.b64encode(buffer.getbuffer()).decode('utf-8')
+    return f'data:image/jpeg;base64,{image_data}'
+
+# Аватар по умолчанию для пользователей без фото; строка собирается один раз
+DEFAULT_AVATAR = 'data:image/svg+xml,<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100"><circle cx="50" cy="50" r="50" fill="%23667eea"/><circle cx="50" cy="38" r="16" fill="white"/><path d="M22 80a28 28 0 0 1 56 0z" fill="white"/></svg>'
 
 # =============== ENHANCED TEMPLATES ===============
 
@@ -841,6 +275,8 @@ LOGIN_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Вход</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <!-- ШРИФТ -->
     <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <!-- ИКОНКИ -->
@@ -898,6 +334,7 @@ LOGIN_TEMPLATE = """
             padding: var(--space-4);
             box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05);
             margin-bottom: var(--space-3);
+            contain: layout style;
         }
         .logo-header {
             text-align: center;
@@ -975,7 +412,7 @@ LOGIN_TEMPLATE = """
             align-items: center;
             justify-content: center;
             gap: var(--space-1);
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn-primary {
             background: var(--primary-red);
@@ -1081,6 +518,8 @@ REGISTER_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Регистрация</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <!-- ШРИФТ -->
     <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <!-- ИКОНКИ -->
@@ -1138,6 +577,7 @@ REGISTER_TEMPLATE = """
             padding: var(--space-4);
             box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05);
             margin-bottom: var(--space-3);
+            contain: layout style;
         }
         .logo-header {
             text-align: center;
@@ -1215,7 +655,7 @@ REGISTER_TEMPLATE = """
             align-items: center;
             justify-content: center;
             gap: var(--space-1);
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn-primary {
             background: var(--primary-red);
@@ -1335,6 +775,8 @@ DASHBOARD_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Панель студента</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <!-- ШРИФТ -->
     <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <!-- ИКОНКИ -->
@@ -1392,6 +834,7 @@ DASHBOARD_TEMPLATE = """
             padding: var(--space-4);
             box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05);
             margin-bottom: var(--space-3);
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -1420,6 +863,7 @@ DASHBOARD_TEMPLATE = """
             padding: var(--space-3);
             text-align: center;
             box-shadow: 0 4px 12px rgba(225, 37, 83, 0.1);
+            contain: layout style;
         }
         .stat-card.green {
             border-color: var(--accent-green);
@@ -1479,7 +923,7 @@ DASHBOARD_TEMPLATE = """
             align-items: center;
             justify-content: center;
             gap: var(--space-1);
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
             text-decoration: none;
             position: relative;
             overflow: hidden;
@@ -1633,6 +1077,8 @@ SCAN_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Сканировать QR</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <!-- ШРИФТ -->
     <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <!-- ИКОНКИ -->
@@ -1685,6 +1131,7 @@ SCAN_TEMPLATE = """
             padding: var(--space-4);
             box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05);
             margin-bottom: var(--space-3);
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -1741,7 +1188,7 @@ SCAN_TEMPLATE = """
             align-items: center;
             justify-content: center;
             gap: var(--space-1);
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn-success {
             background: var(--accent-green);
@@ -2011,6 +1458,8 @@ EVENTS_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Мероприятия</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <!-- ШРИФТ -->
     <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <!-- ИКОНКИ -->
@@ -2063,6 +1512,7 @@ EVENTS_TEMPLATE = """
             padding: var(--space-4);
             box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05);
             margin-bottom: var(--space-3);
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -2104,7 +1554,7 @@ EVENTS_TEMPLATE = """
             padding: var(--space-3);
             margin-bottom: var(--space-3);
             box-shadow: 0 4px 12px rgba(225, 37, 83, 0.1);
-            transition: all 0.2s ease;
+            transition: transform 0.2s ease, box-shadow 0.2s ease;
         }
         .event-card:hover {
             transform: translateY(-3px);
@@ -2178,7 +1628,7 @@ EVENTS_TEMPLATE = """
             display: inline-flex;
             align-items: center;
             gap: var(--space-1);
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn:hover {
             border-color: var(--primary-red);
@@ -2222,26 +1672,26 @@ EVENTS_TEMPLATE = """
             {% if events %}
                 {% for event in events %}
                 <div class="event-card">
-                    <h2>{{ event[1] }}</h2>
-                    {% if event[2] %}
-                    <p class="desc">{{ event[2] }}</p>
+                    <h2>{{ event[0] }}</h2>
+                    {% if event[1] %}
+                    <p class="desc">{{ event[1] }}</p>
                     {% endif %}
                     <div class="event-meta">
                         <div class="meta-item">
                             <i class='bx bx-calendar'></i>
-                            <span>{{ event[3] }}</span>
+                            <span>{{ event[2] }}</span>
                         </div>
                         <div class="meta-item">
                             <i class='bx bx-time'></i>
-                            <span>{{ event[4] }} – {{ event[5] }}</span>
+                            <span>{{ event[3] }} – {{ event[4] }}</span>
                         </div>
                         <div class="meta-item">
                             <i class='bx bx-map'></i>
-                            <span>{{ event[7] }}</span>
+                            <span>{{ event[6] }}</span>
                         </div>
                         <div class="meta-item green">
                             <i class='bx bx-hourglass'></i>
-                            <span>{{ event[6] }} часов</span>
+                            <span>{{ event[5] }} часов</span>
                         </div>
                     </div>
                 </div>
@@ -2266,6 +1716,8 @@ HISTORY_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — История посещений</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <!-- ШРИФТ -->
     <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <!-- ИКОНКИ -->
@@ -2318,6 +1770,7 @@ HISTORY_TEMPLATE = """
             padding: var(--space-4);
             box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05);
             margin-bottom: var(--space-3);
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -2418,7 +1871,7 @@ HISTORY_TEMPLATE = """
             display: inline-flex;
             align-items: center;
             gap: var(--space-1);
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn:hover {
             border-color: var(--primary-red);
@@ -2505,6 +1958,8 @@ SHOP_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Магазин</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <!-- ШРИФТ -->
     <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <!-- ИКОНКИ -->
@@ -2557,6 +2012,7 @@ SHOP_TEMPLATE = """
             padding: var(--space-4);
             box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05);
             margin-bottom: var(--space-3);
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -2647,7 +2103,7 @@ SHOP_TEMPLATE = """
             overflow: hidden;
             box-shadow: 0 4px 8px rgba(0,0,0,0.08);
             border: 1px solid var(--light-grey);
-            transition: all 0.2s ease;
+            transition: transform 0.2s ease, box-shadow 0.2s ease;
         }
         .item-card:hover {
             transform: translateY(-3px);
@@ -2705,7 +2161,7 @@ SHOP_TEMPLATE = """
             font-size: var(--btn-size);
             cursor: pointer;
             text-align: center;
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn-primary {
             background: var(--primary-red);
@@ -2795,21 +2251,21 @@ SHOP_TEMPLATE = """
             <div class="grid grid-3">
                 {% for item in items %}
                 <div class="item-card">
-                    <img src="{{ item[2] }}" class="item-image" alt="{{ item[1] }}">
+                    <img src="/shop/image/{{ item[0] }}" loading="lazy" class="item-image" alt="{{ item[1] }}">
                     <div class="item-content">
                         <div class="item-name">{{ item[1] }}</div>
-                        <p class="item-desc">{{ item[4] }}</p>
+                        <p class="item-desc">{{ item[3] }}</p>
                         <div class="item-footer">
-                            <div class="item-price">🪙 {{ item[3] }}</div>
-                            <div class="item-stock {% if item[5] > 0 %}in-stock{% endif %}">
-                                {% if item[5] > 0 %}
-                                <i class='bx bx-check-circle'></i> {{ item[5] }}
+                            <div class="item-price">🪙 {{ item[2] }}</div>
+                            <div class="item-stock {% if item[4] > 0 %}in-stock{% endif %}">
+                                {% if item[4] > 0 %}
+                                <i class='bx bx-check-circle'></i> {{ item[4] }}
                                 {% else %}
                                 <i class='bx bx-x-circle'></i> Нет
                                 {% endif %}
                             </div>
                         </div>
-                        {% if item[5] > 0 %}
+                        {% if item[4] > 0 %}
                         <form method="POST" action="/shop/buy/{{ item[0] }}" style="margin-top: var(--space-2);">
                             <button type="submit" class="btn btn-primary">Купить сейчас</button>
                         </form>
@@ -2840,6 +2296,8 @@ PROFILE_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Мой профиль</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <!-- ШРИФТ -->
     <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <!-- ИКОНКИ -->
@@ -2892,6 +2350,7 @@ PROFILE_TEMPLATE = """
             padding: var(--space-4);
             box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05);
             margin-bottom: var(--space-3);
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -2953,7 +2412,7 @@ PROFILE_TEMPLATE = """
             display: inline-flex;
             align-items: center;
             gap: var(--space-1);
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn-primary {
             background: var(--primary-red);
@@ -3190,9 +2649,9 @@ PROFILE_TEMPLATE = """
                         <tbody>
                             {% for purchase in pending_purchases %}
                             <tr>
-                                <td><strong>{{ purchase[1] }}</strong></td>
-                                <td><span class="code-badge">{{ purchase[2] }}</span></td>
-                                <td>{{ purchase[3] }}</td>
+                                <td><strong>{{ purchase[0] }}</strong></td>
+                                <td><span class="code-badge">{{ purchase[1] }}</span></td>
+                                <td>{{ purchase[2] }}</td>
                             </tr>
                             {% endfor %}
                         </tbody>
@@ -3213,6 +2672,8 @@ CERTIFICATE_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Сертификат</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <!-- ШРИФТ -->
     <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <!-- ИКОНКИ -->
@@ -3379,7 +2840,7 @@ CERTIFICATE_TEMPLATE = """
             font-weight: var(--btn-weight);
             font-size: var(--btn-size);
             text-decoration: none;
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn:hover {
             background: var(--primary-red);
@@ -3451,6 +2912,8 @@ CREATOR_LOGIN_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Вход для организаторов</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=Manrope:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <style>
         * {
@@ -3490,6 +2953,7 @@ CREATOR_LOGIN_TEMPLATE = """
             padding: 40px;
             box-shadow: 0 10px 30px -5px rgba(41, 41, 41, 0.1);
             border: 1px solid var(--gray-light);
+            contain: layout style;
         }
         .logo-header {
             text-align: center;
@@ -3630,6 +3094,8 @@ CREATOR_DASHBOARD_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Панель организатора</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=Manrope:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <style>
         * {
@@ -3666,6 +3132,7 @@ CREATOR_DASHBOARD_TEMPLATE = """
             box-shadow: 0 8px 24px rgba(41, 41, 41, 0.08);
             border: 1px solid var(--gray-light);
             margin-bottom: 28px;
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -3753,7 +3220,7 @@ CREATOR_DASHBOARD_TEMPLATE = """
             display: inline-flex;
             align-items: center;
             gap: 8px;
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn:hover {
             background: #c91f47;
@@ -3775,7 +3242,7 @@ CREATOR_DASHBOARD_TEMPLATE = """
             padding: 28px;
             margin-bottom: 24px;
             box-shadow: 0 6px 15px -4px rgba(225, 37, 83, 0.15);
-            transition: all 0.2s ease;
+            transition: transform 0.2s ease, box-shadow 0.2s ease;
         }
         .event-card:hover {
             transform: translateY(-4px);
@@ -3937,6 +3404,8 @@ EVENT_DETAIL_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Мероприятие</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=Manrope:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <style>
         * {
@@ -3973,6 +3442,7 @@ EVENT_DETAIL_TEMPLATE = """
             box-shadow: 0 8px 24px rgba(41, 41, 41, 0.08);
             border: 1px solid var(--gray-light);
             margin-bottom: 28px;
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -4001,6 +3471,7 @@ EVENT_DETAIL_TEMPLATE = """
             padding: 24px;
             text-align: center;
             box-shadow: 0 6px 15px -4px rgba(225, 37, 83, 0.15);
+            contain: layout style;
         }
         .stat-card.green {
             border-color: var(--secondary);
@@ -4030,7 +3501,7 @@ EVENT_DETAIL_TEMPLATE = """
             margin-top: 25px;
             cursor: pointer;
             box-shadow: 0 8px 20px -5px rgba(225, 37, 83, 0.15);
-            transition: all 0.2s ease;
+            transition: transform 0.2s ease, box-shadow 0.2s ease;
         }
         .qr-section:hover {
             transform: translateY(-4px);
@@ -4145,7 +3616,7 @@ EVENT_DETAIL_TEMPLATE = """
             display: inline-flex;
             align-items: center;
             gap: 8px;
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn:hover {
             border-color: var(--primary);
@@ -4161,7 +3632,6 @@ EVENT_DETAIL_TEMPLATE = """
             width: 100%;
             height: 100%;
             background: rgba(0, 0, 0, 0.85);
-            backdrop-filter: blur(10px);
             justify-content: center;
             align-items: center;
         }
@@ -4256,12 +3726,12 @@ EVENT_DETAIL_TEMPLATE = """
                 </div>
             </div>
 
-            <div class="qr-section" onclick="openQRModal()">
+            <div class="qr-section" onclick="openQRModal()" data-event-id="{{ event_id }}" data-expires-in="{{ expires_in }}">
                 <h2 style="font-weight: 800; color: var(--primary);">📱 QR-код для выхода</h2>
                 <p style="color: var(--gray-dark); margin-bottom: 20px;">Покажите этот код студентам в конце мероприятия</p>
                 <img id="qr-image" src="{{ qr_image }}" class="qr-code-img" alt="QR Code">
                 <div class="exit-code">{{ exit_code }}</div>
-                <div class="countdown">Обновление через <span id="countdown">60</span> сек</div>
+                <div class="countdown">Обновление через <span id="countdown">{{ expires_in }}</span> сек</div>
                 <p class="qr-hint">💡 Нажмите для увеличения</p>
             </div>
 
@@ -4314,8 +3784,10 @@ EVENT_DETAIL_TEMPLATE = """
     </div>
 
     <script>
-        let countdown = 10
-        const eventId = {{ event_id }};
+        // Данные страницы берутся из data-атрибутов, поэтому скрипт статичен и кэшируется как файл
+        const qrSection = document.querySelector('.qr-section');
+        const eventId = qrSection.dataset.eventId;
+        let countdown = Number(qrSection.dataset.expiresIn);
         function openQRModal() {
             document.getElementById('qr-modal').classList.add('active');
         }
@@ -4324,19 +3796,38 @@ EVENT_DETAIL_TEMPLATE = """
         }
         function updateQR() {
             fetch(`/api/refresh-qr/${eventId}`)
-                .then(response => response.json())
+                .then(response => {
+                    // Сессия истекла — на вход; мероприятие недоступно — повторять бессмысленно
+                    if (response.status === 401) {
+                        clearInterval(countdownTimer);
+                        window.location.href = '/creator/login';
+                        return null;
+                    }
+                    if (response.status === 404) {
+                        clearInterval(countdownTimer);
+                        return null;
+                    }
+                    if (!response.ok) {
+                        throw new Error(response.status);
+                    }
+                    return response.json();
+                })
                 .then(data => {
-                    document.getElementById('qr-image').src = data.qr_image + '?t=' + Date.now();
-                    document.getElementById('modal-qr-image').src = data.qr_image + '?t=' + Date.now();
+                    if (!data) return;
+                    document.getElementById('qr-image').src = data.qr_image;
+                    document.getElementById('modal-qr-image').src = data.qr_image;
                     document.querySelector('.exit-code').textContent = data.exit_code;
                     document.querySelector('.modal-code').textContent = data.exit_code;
-                    countdown = 10
-                });
+                    countdown = data.expires_in;
+                })
+                .catch(() => { countdown = 5; });
         }
-        setInterval(() => {
+        // Код меняется раз в минуту — запрос уходит только на границе минуты
+        const countdownTimer = setInterval(() => {
+            if (countdown <= 0) return;
             countdown--;
             document.getElementById('countdown').textContent = countdown;
-            if (countdown <= 0) {
+            if (countdown === 0) {
                 updateQR();
             }
         }, 1000);
@@ -4352,6 +3843,8 @@ ADMIN_LOGIN_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Админ-панель</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=Manrope:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <style>
         * {
@@ -4391,6 +3884,7 @@ ADMIN_LOGIN_TEMPLATE = """
             padding: 40px;
             box-shadow: 0 10px 30px -5px rgba(41, 41, 41, 0.1);
             border: 1px solid var(--gray-light);
+            contain: layout style;
         }
         .logo-header {
             text-align: center;
@@ -4510,6 +4004,8 @@ ADMIN_DASHBOARD_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Админ-панель</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=Manrope:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <style>
         * {
@@ -4546,6 +4042,7 @@ ADMIN_DASHBOARD_TEMPLATE = """
             box-shadow: 0 8px 24px rgba(41, 41, 41, 0.08);
             border: 1px solid var(--gray-light);
             margin-bottom: 28px;
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -4640,7 +4137,7 @@ ADMIN_DASHBOARD_TEMPLATE = """
             display: inline-flex;
             align-items: center;
             gap: 8px;
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn:hover {
             background: #c91f47;
@@ -4877,13 +4374,13 @@ ADMIN_DASHBOARD_TEMPLATE = """
             <div class="grid grid-3">
                 {% for item in shop_items %}
                 <div class="item-card">
-                    <img src="{{ item[2] }}" class="item-img" alt="{{ item[1] }}">
+                    <img src="/shop/image/{{ item[0] }}" loading="lazy" class="item-img" alt="{{ item[1] }}">
                     <div class="item-content">
                         <div class="item-name">{{ item[1] }}</div>
-                        <p class="item-desc">{{ item[4] }}</p>
+                        <p class="item-desc">{{ item[3] }}</p>
                         <div class="item-footer">
-                            <div class="item-price">🪙 {{ item[3] }}</div>
-                            <div class="item-qty">В наличии: {{ item[5] }}</div>
+                            <div class="item-price">🪙 {{ item[2] }}</div>
+                            <div class="item-qty">В наличии: {{ item[4] }}</div>
                         </div>
                         <form method="POST" action="/admin/delete-shop-item/{{ item[0] }}" style="margin-top: 18px;">
                             <button type="submit" class="btn" style="width: 100%; padding: 10px; background: #ef4444;">Удалить</button>
@@ -4911,6 +4408,8 @@ ANALYTICS_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Аналитика</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=Manrope:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <style>
         * {
@@ -4947,6 +4446,7 @@ ANALYTICS_TEMPLATE = """
             box-shadow: 0 8px 24px rgba(41, 41, 41, 0.08);
             border: 1px solid var(--gray-light);
             margin-bottom: 28px;
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -4975,6 +4475,7 @@ ANALYTICS_TEMPLATE = """
             padding: 30px 20px;
             text-align: center;
             box-shadow: 0 6px 15px -4px rgba(225, 37, 83, 0.15);
+            contain: layout style;
         }
         .stat-card:nth-child(2) {
             border-color: var(--gray-dark);
@@ -5140,7 +4641,7 @@ ANALYTICS_TEMPLATE = """
             display: inline-flex;
             align-items: center;
             gap: 8px;
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn:hover {
             border-color: var(--primary);
@@ -5302,6 +4803,8 @@ STUDENTS_LIST_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Список студентов</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=Manrope:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <style>
         * {
@@ -5338,6 +4841,7 @@ STUDENTS_LIST_TEMPLATE = """
             box-shadow: 0 8px 24px rgba(41, 41, 41, 0.08);
             border: 1px solid var(--gray-light);
             margin-bottom: 28px;
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -5404,7 +4908,7 @@ STUDENTS_LIST_TEMPLATE = """
             color: var(--primary);
         }
         tbody tr {
-            transition: all 0.15s ease;
+            transition: background 0.15s ease, transform 0.15s ease;
             cursor: pointer;
         }
         tbody tr:hover {
@@ -5441,7 +4945,7 @@ STUDENTS_LIST_TEMPLATE = """
             display: inline-flex;
             align-items: center;
             gap: 8px;
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn:hover {
             border-color: var(--primary);
@@ -5499,21 +5003,21 @@ STUDENTS_LIST_TEMPLATE = """
 
             <div style="overflow-x: auto;">
                 <table id="students-table">
-                    <thead>
+                    <thead id="students-head">
                         <tr>
-                            <th onclick="sortTable(0)">ID ↕</th>
-                            <th onclick="sortTable(1)">Имя ↕</th>
-                            <th onclick="sortTable(2)">Username ↕</th>
-                            <th onclick="sortTable(3)">Факультет ↕</th>
-                            <th onclick="sortTable(4)">Группа ↕</th>
-                            <th onclick="sortTable(5)">Часы ↕</th>
-                            <th onclick="sortTable(6)">Койны ↕</th>
+                            <th data-sort="0">ID ↕</th>
+                            <th data-sort="1">Имя ↕</th>
+                            <th data-sort="2">Username ↕</th>
+                            <th data-sort="3">Факультет ↕</th>
+                            <th data-sort="4">Группа ↕</th>
+                            <th data-sort="5">Часы ↕</th>
+                            <th data-sort="6">Койны ↕</th>
                             <th>Статус</th>
                         </tr>
                     </thead>
-                    <tbody>
+                    <tbody id="students-body">
                         {% for student in students %}
-                        <tr class="student-row" onclick="window.location.href='/admin/student/{{ student[0] }}'"
+                        <tr class="student-row" data-id="{{ student[0] }}"
                             data-name="{{ student[1].lower() }}"
                             data-faculty="{{ student[3] }}"
                             data-group="{{ student[4] }}">
@@ -5540,25 +5044,43 @@ STUDENTS_LIST_TEMPLATE = """
     </div>
 
     <script>
+        let filterPending = false;
         function filterStudents() {
+            // Несколько нажатий клавиш за один кадр дают одну перерисовку
+            if (filterPending) return;
+            filterPending = true;
+            requestAnimationFrame(applyFilter);
+        }
+        function applyFilter() {
+            filterPending = false;
             const searchName = document.getElementById('search-name').value.toLowerCase();
             const filterFaculty = document.getElementById('filter-faculty').value;
             const filterGroup = document.getElementById('filter-group').value;
-            const rows = document.querySelectorAll('.student-row');
-            rows.forEach(row => {
-                const name = row.getAttribute('data-name');
-                const faculty = row.getAttribute('data-faculty');
-                const group = row.getAttribute('data-group');
-                const matchName = name.includes(searchName);
-                const matchFaculty = !filterFaculty || faculty === filterFaculty;
-                const matchGroup = !filterGroup || group === filterGroup;
-                if (matchName && matchFaculty && matchGroup) {
-                    row.style.display = '';
-                } else {
-                    row.style.display = 'none';
+            studentRows().forEach(item => {
+                const matchName = item.name.includes(searchName);
+                const matchFaculty = !filterFaculty || item.faculty === filterFaculty;
+                const matchGroup = !filterGroup || item.group === filterGroup;
+                const visible = matchName && matchFaculty && matchGroup;
+                if (visible !== item.visible) {
+                    item.visible = visible;
+                    item.row.style.display = visible ? '' : 'none';
                 }
             });
         }
+        let rowCache = null;
+        function studentRows() {
+            // data-атрибуты строк читаются из DOM один раз, а не при каждом нажатии клавиши
+            if (!rowCache) {
+                rowCache = Array.from(document.querySelectorAll('.student-row'), row => ({
+                    row: row,
+                    name: row.dataset.name,
+                    faculty: row.dataset.faculty,
+                    group: row.dataset.group,
+                    visible: true
+                }));
+            }
+            return rowCache;
+        }
         function sortTable(columnIndex) {
             const table = document.getElementById('students-table');
             const tbody = table.querySelector('tbody');
@@ -5573,8 +5095,20 @@ STUDENTS_LIST_TEMPLATE = """
                 }
                 return aValue.localeCompare(bValue);
             });
-            rows.forEach(row => tbody.appendChild(row));
-        }
+            // Одна вставка фрагмента вместо перестановки строк по одной
+            const fragment = document.createDocumentFragment();
+            rows.forEach(row => fragment.appendChild(row));
+            tbody.appendChild(fragment);
+        }
+        // Один делегированный обработчик на таблицу вместо inline onclick на каждой строке
+        document.getElementById('students-head').addEventListener('click', event => {
+            const th = event.target.closest('th[data-sort]');
+            if (th) sortTable(Number(th.dataset.sort));
+        });
+        document.getElementById('students-body').addEventListener('click', event => {
+            const row = event.target.closest('.student-row');
+            if (row) window.location.href = '/admin/student/' + row.dataset.id;
+        });
     </script>
 </body>
 </html>
@@ -5587,6 +5121,8 @@ STUDENT_PROFILE_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>URBAN COLLEGE — Профиль студента</title>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=Manrope:wght@300;400;500;600;700;800;900&display=swap" rel="stylesheet">
     <style>
         * {
@@ -5623,6 +5159,7 @@ STUDENT_PROFILE_TEMPLATE = """
             box-shadow: 0 8px 24px rgba(41, 41, 41, 0.08);
             border: 1px solid var(--gray-light);
             margin-bottom: 28px;
+            contain: layout style;
         }
         .header {
             display: flex;
@@ -5670,6 +5207,7 @@ STUDENT_PROFILE_TEMPLATE = """
             padding: 24px;
             text-align: center;
             box-shadow: 0 6px 15px -4px rgba(225, 37, 83, 0.15);
+            contain: layout style;
         }
         .stat-card:nth-child(2) {
             border-color: var(--secondary);
@@ -5806,7 +5344,7 @@ STUDENT_PROFILE_TEMPLATE = """
             display: inline-flex;
             align-items: center;
             gap: 8px;
-            transition: all 0.2s ease;
+            transition: background 0.2s ease, color 0.2s ease, border-color 0.2s ease, transform 0.2s ease, box-shadow 0.2s ease;
         }
         .btn:hover {
             border-color: var(--primary);
@@ -5968,6 +5506,97 @@ STUDENT_PROFILE_TEMPLATE = """
 </body>
 </html>
 """
+_CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+_CSS_SPACE_RE = re.compile(r'\s+')
+_CSS_PUNCT_RE = re.compile(r'\s*([{};,>])\s*')
+_STYLE_BLOCK_RE = re.compile(r'(<style>)(.*?)(</style>)', re.S)
+
+def minify_css(css):
+    """Удаление комментариев и лишних пробелов из CSS"""
+    css = _CSS_COMMENT_RE.sub('', css)
+    css = _CSS_SPACE_RE.sub(' ', css)
+    css = _CSS_PUNCT_RE.sub(r'\1', css)
+    css = css.replace(': ', ':').replace(';}', '}')
+    return css.strip()
+
+# Статические файлы, собранные из шаблонов: имя с хешем -> (байты, gzip-версия, mimetype)
+STATIC_ASSETS = {}
+
+def register_asset(name, ext, content, mimetype):
+    """Регистрация статического файла; хеш в имени позволяет кэшировать его навсегда"""
+    body = content.encode('utf-8')
+    digest = hashlib.md5(body).hexdigest()[:8]
+    filename = f'{name}.{digest}.{ext}'
+    # Кодируем и сжимаем один раз при импорте с максимальной степенью, а не на каждый запрос
+    STATIC_ASSETS[filename] = (body, gzip.compress(body, compresslevel=9, mtime=0), mimetype)
+    return f'/assets/{filename}'
+
+def externalize_styles(name, template):
+    """Вынос <style> блоков шаблона в кэшируемые CSS-файлы (один раз при импорте)"""
+    def replace(match):
+        url = register_asset(name, 'css', minify_css(match.group(2)), 'text/css')
+        return f'<link rel="stylesheet" href="{url}">'
+    return _STYLE_BLOCK_RE.sub(replace, template)
+
+_SCRIPT_BLOCK_RE = re.compile(r'<script>(.*?)</script>', re.S)
+
+def externalize_scripts(name, template):
+    """Вынос статических <script> блоков в кэшируемые JS-файлы; блоки с Jinja остаются в шаблоне"""
+    def replace(match):
+        script = match.group(1)
+        if '{{' in script or '{%' in script:
+            return match.group(0)
+        url = register_asset(name, 'js', textwrap.dedent(script).strip() + '\n', 'application/javascript')
+        return f'<script src="{url}"></script>'
+    return _SCRIPT_BLOCK_RE.sub(replace, template)
+
+# Шаблоны компилируются Jinja один раз и берутся из кэша окружения,
+# а не разбираются заново на каждый запрос, как с render_template_string
+TEMPLATES = {
+    'login.html': LOGIN_TEMPLATE,
+    'register.html': REGISTER_TEMPLATE,
+    'dashboard.html': DASHBOARD_TEMPLATE,
+    'scan.html': SCAN_TEMPLATE,
+    'events.html': EVENTS_TEMPLATE,
+    'history.html': HISTORY_TEMPLATE,
+    'shop.html': SHOP_TEMPLATE,
+    'profile.html': PROFILE_TEMPLATE,
+    'certificate.html': CERTIFICATE_TEMPLATE,
+    'creator_login.html': CREATOR_LOGIN_TEMPLATE,
+    'creator_dashboard.html': CREATOR_DASHBOARD_TEMPLATE,
+    'event_detail.html': EVENT_DETAIL_TEMPLATE,
+    'admin_login.html': ADMIN_LOGIN_TEMPLATE,
+    'admin_dashboard.html': ADMIN_DASHBOARD_TEMPLATE,
+    'analytics.html': ANALYTICS_TEMPLATE,
+    'students_list.html': STUDENTS_LIST_TEMPLATE,
+    'student_profile.html': STUDENT_PROFILE_TEMPLATE,
+}
+
+def build_template(name, template):
+    """Подготовка шаблона к регистрации: CSS и статический JS выносятся в /assets"""
+    asset_name = name.rsplit('.', 1)[0]
+    return externalize_scripts(asset_name, externalize_styles(asset_name, template))
+
+app.jinja_loader = DictLoader({name: build_template(name, template) for name, template in TEMPLATES.items()})
+# Шаблоны живут в коде и не меняются во время работы: проверка актуальности не нужна даже в debug
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+app.jinja_env.auto_reload = False
+# Помощники для шаблонов регистрируются один раз, а не передаются в каждый render
+app.jinja_env.globals['enumerate'] = enumerate
+# Компилируем все шаблоны при импорте, чтобы воркеры после --preload получили их готовыми
+for template_name in TEMPLATES:
+    app.jinja_env.get_template(template_name)
+
+def first_name(full_name):
+    """Имя для приветствия; считается один раз при входе и хранится в сессии"""
+    parts = full_name.split() if full_name else None
+    return parts[0] if parts else 'User'
+
+@functools.lru_cache(maxsize=None)
+def render_static_page(template_name):
+    """Страница без переменных рендерится и кодируется в UTF-8 один раз на процесс"""
+    return render_template(template_name).encode('utf-8')
+
 # =============== ROUTES ===============
 
 @app.route('/')
@@ -5986,32 +5615,35 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        conn = sqlite3.connect('urban_community.db')
+        conn = get_db()
         c = conn.cursor()
         
-        hashed_password = hash_password(password)
-        c.execute('SELECT id, full_name, first_login FROM users WHERE username = ? AND password = ?',
-                  (username, hashed_password))
+        c.execute('SELECT id, full_name, first_login, password FROM users WHERE username = ?',
+                  (username,))
         user = c.fetchone()
         
-        if user:
+        if verify_password(user[3] if user else None, password):
             session['user_id'] = user[0]
             session['username'] = username
             session['full_name'] = user[1]
+            session['first_name'] = first_name(user[1])
+            
+            if is_legacy_hash(user[3]):
+                c.execute('UPDATE users SET password = ? WHERE id = ?', (hash_password(password), user[0]))
             
             if user[2] == 1:
                 c.execute('UPDATE users SET first_login = 0 WHERE id = ?', (user[0],))
-                conn.commit()
-                conn.close()
+            
+            conn.commit()
+            
+            if user[2] == 1:
                 return redirect(url_for('certificate'))
             
-            conn.close()
             return redirect(url_for('dashboard'))
         
-        conn.close()
-        return render_template_string(LOGIN_TEMPLATE, error='❌ Неверный логин или пароль')
+        return render_template('login.html', error='❌ Неверный логин или пароль')
     
-    return render_template_string(LOGIN_TEMPLATE)
+    return render_static_page('login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -6025,7 +5657,7 @@ def register():
         
         hashed_password = hash_password(password)
         
-        conn = sqlite3.connect('urban_community.db')
+        conn = get_db()
         c = conn.cursor()
         
         try:
@@ -6038,62 +5670,57 @@ def register():
             session['user_id'] = user_id
             session['username'] = username
             session['full_name'] = full_name
+            session['first_name'] = first_name(full_name)
             
-            conn.close()
             return redirect(url_for('certificate'))
         except sqlite3.IntegrityError:
-            conn.close()
-            return render_template_string(REGISTER_TEMPLATE, 
+            return render_template('register.html', 
                                         error='❌ Этот username уже занят. Выберите другой.')
     
-    return render_template_string(REGISTER_TEMPLATE)
+    return render_static_page('register.html')
 
 @app.route('/dashboard')
 def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
-    c.execute('SELECT coins, hours, full_name, avatar FROM users WHERE id = ?', (session['user_id'],))
+    c.execute('SELECT coins, hours, avatar FROM users WHERE id = ?', (session['user_id'],))
     user_data = c.fetchone()
-    conn.close()
     
     if not user_data:
         return redirect(url_for('login'))
     
-    avatar_url = user_data[3] if user_data[3] else 'data:image/svg+xml,<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100"><circle cx="50" cy="50" r="50" fill="%23667eea"/><text x="50" y="50" font-size="40" fill="white" text-anchor="middle" dominant-baseline="central">👤</text></svg>'
-    
-    show_certificate = True if user_data and int(user_data[1]) > 0 else False
+    coins, hours, avatar = user_data
     
-    return render_template_string(DASHBOARD_TEMPLATE,
-                                 user_name=session['full_name'].split()[0] if session.get('full_name') else 'User',
-                                 hours=user_data[1] if user_data else 0,
-                                 coins=user_data[0] if user_data else 0,
-                                 avatar_url=avatar_url,
-                                 show_certificate=show_certificate)
+    return render_template('dashboard.html',
+                                 user_name=session.get('first_name') or first_name(session.get('full_name')),
+                                 hours=hours,
+                                 coins=coins,
+                                 avatar_url=avatar or DEFAULT_AVATAR,
+                                 show_certificate=int(hours) > 0)
 
 @app.route('/certificate')
 def certificate():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
-    c.execute('SELECT full_name, faculty, group_name, created_at FROM users WHERE id = ?', (session['user_id'],))
+    # Дата форматируется самой SQLite, без разбора строки в Python
+    c.execute("SELECT full_name, faculty, group_name, strftime('%d.%m.%Y', created_at) FROM users WHERE id = ?",
+              (session['user_id'],))
     user = c.fetchone()
-    conn.close()
     
     if not user:
         return redirect(url_for('login'))
     
-    date = datetime.strptime(user[3], '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y')
-    
-    return render_template_string(CERTIFICATE_TEMPLATE,
+    return render_template('certificate.html',
                                  full_name=user[0],
                                  faculty=user[1],
                                  group_name=user[2],
-                                 date=date)
+                                 date=user[3])
 
 @app.route('/scan', methods=['GET', 'POST'])
 def scan():
@@ -6104,35 +5731,28 @@ def scan():
         qr_code = request.form.get('qr_code', '').strip().upper()
         
         if not qr_code or len(qr_code) != 4:
-            return render_template_string(SCAN_TEMPLATE, error='❌ Неверный формат кода')
+            return render_template('scan.html', error='❌ Неверный формат кода')
         
-        conn = sqlite3.connect('urban_community.db')
+        conn = get_db()
         c = conn.cursor()
         
         current_minute = int(time.time() // 60)
-        c.execute('SELECT id, name, hours, date, start_time, end_time FROM events')
-        events = c.fetchall()
-        
-        found_event = None
+        minutes = (current_minute, current_minute - 1)
         
-        for event in events:
-            event_id = event[0]
-            for minute_offset in [0, -1]:
-                test_minute = current_minute + minute_offset
-                
-                exit_seed = f"{event_id}-exit-{test_minute}"
-                exit_hash = hashlib.md5(exit_seed.encode()).hexdigest()[:4].upper()
-                
-                if exit_hash == qr_code:
-                    found_event = event
-                    break
-            
-            if found_event:
+        # Перебираем только id; строку мероприятия читаем уже после совпадения
+        found_id = None
+        for (event_id,) in c.execute('SELECT id FROM events'):
+            if any(generate_time_based_qr(event_id, minute) == qr_code for minute in minutes):
+                found_id = event_id
                 break
         
+        found_event = None
+        if found_id is not None:
+            c.execute('SELECT id, name, hours, date, start_time, end_time FROM events WHERE id = ?', (found_id,))
+            found_event = c.fetchone()
+        
         if not found_event:
-            conn.close()
-            return render_template_string(SCAN_TEMPLATE, error='❌ QR-код не найден или истек')
+            return render_template('scan.html', error='❌ QR-код не найден или истек')
         
         event_id, event_name, event_hours, event_date, start_time, end_time = found_event
         user_id = session['user_id']
@@ -6142,47 +5762,44 @@ def scan():
         existing = c.fetchone()
         
         if existing:
-            conn.close()
-            return render_template_string(SCAN_TEMPLATE, 
+            return render_template('scan.html', 
                                         error=f'⚠️ Вы уже отметили выход с "{event_name}"')
         
         coins_to_add = event_hours
         
         c.execute('''INSERT INTO scans (user_id, event_id, exit_time, hours_earned, coins_earned, status) 
-                    VALUES (?, ?, ?, ?, ?, ?)''',
-                 (user_id, event_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 
-                  event_hours, coins_to_add, 'completed'))
+                    VALUES (?, ?, datetime('now', 'localtime'), ?, ?, ?)''',
+                 (user_id, event_id, event_hours, coins_to_add, 'completed'))
         
         c.execute('UPDATE users SET hours = hours + ?, coins = coins + ? WHERE id = ?',
                  (event_hours, coins_to_add, user_id))
         
         conn.commit()
-        conn.close()
         
-        return render_template_string(SCAN_TEMPLATE, 
+        return render_template('scan.html', 
                                     success=f'✅ Успешно! Вы получили {event_hours} часов и {coins_to_add} койнов за "{event_name}"')
     
-    return render_template_string(SCAN_TEMPLATE)
+    # Без сообщений страница сканера одинакова для всех студентов
+    return render_static_page('scan.html')
 
 @app.route('/events')
 def events():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
-    c.execute('SELECT id, name, description, date, start_time, end_time, hours, location FROM events ORDER BY date DESC')
+    c.execute('SELECT name, description, date, start_time, end_time, hours, location FROM events ORDER BY date DESC')
     events_list = c.fetchall()
-    conn.close()
     
-    return render_template_string(EVENTS_TEMPLATE, events=events_list)
+    return render_template('events.html', events=events_list)
 
 @app.route('/history')
 def history():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     c.execute('''SELECT e.name, s.exit_time, s.hours_earned, s.coins_earned
                  FROM scans s
@@ -6190,63 +5807,84 @@ def history():
                  WHERE s.user_id = ?
                  ORDER BY s.exit_time DESC''', (session['user_id'],))
     scans = c.fetchall()
-    conn.close()
     
-    return render_template_string(HISTORY_TEMPLATE, scans=scans)
+    return render_template('history.html', scans=scans)
 
 @app.route('/shop')
 def shop():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('SELECT coins FROM users WHERE id = ?', (session['user_id'],))
     user_coins = c.fetchone()[0]
     
-    c.execute('SELECT id, name, image_data, price, description, quantity FROM shop_items ORDER BY created_at DESC')
+    c.execute('SELECT id, name, price, description, quantity FROM shop_items ORDER BY created_at DESC')
     items = c.fetchall()
     
-    conn.close()
-    
     success = request.args.get('success')
     error = request.args.get('error')
     purchase_code = request.args.get('code')
     
-    return render_template_string(SHOP_TEMPLATE, 
+    return render_template('shop.html', 
                                  items=items, 
                                  user_coins=user_coins,
                                  success=success,
                                  error=error,
                                  purchase_code=purchase_code)
 
+@app.route('/shop/image/<int:item_id>')
+def shop_item_image(item_id):
+    if 'user_id' not in session and 'admin' not in session:
+        return redirect(url_for('login'))
+    
+    c = get_db().cursor()
+    c.execute('SELECT image_data FROM shop_items WHERE id = ?', (item_id,))
+    item = c.fetchone()
+    
+    if not item:
+        return "Item not found", 404
+    
+    header, image_data = item[0].split(',', 1)
+    mimetype = header[len('data:'):].split(';')[0]
+    
+    # Картинка товара не меняется после создания, а id не переиспользуются
+    response = send_file(io.BytesIO(base64.b64decode(image_data)), mimetype=mimetype,
+                         max_age=31536000, etag=f'shop-item-{item_id}')
+    # Маршрут требует входа: кэшировать можно только в браузере пользователя, не в общих прокси
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
 @app.route('/shop/buy/<int:item_id>', methods=['POST'])
 def buy_item(item_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     
-    c.execute('SELECT coins FROM users WHERE id = ?', (session['user_id'],))
-    user_coins = c.fetchone()[0]
+    # Баланс и товар одним запросом
+    c.execute('''SELECT u.coins, si.id, si.name, si.price, si.quantity
+                 FROM users u
+                 LEFT JOIN shop_items si ON si.id = ?
+                 WHERE u.id = ?''', (item_id, session['user_id']))
+    row = c.fetchone()
     
-    c.execute('SELECT name, price, quantity FROM shop_items WHERE id = ?', (item_id,))
-    item = c.fetchone()
+    if not row:
+        return redirect(url_for('login'))
     
-    if not item:
-        conn.close()
-        return redirect(url_for('shop', error='Товар не найден'))
+    user_coins, found_id, item_name, item_price, item_quantity = row
     
-    item_name, item_price, item_quantity = item
+    if found_id is None:
+        return redirect(url_for('shop', error='Товар не найден'))
     
     if item_quantity <= 0:
-        conn.close()
         return redirect(url_for('shop', error='Товар закончился'))
     
     if user_coins < item_price:
-        conn.close()
         return redirect(url_for('shop', error='Недостаточно койнов'))
     
     purchase_code = generate_purchase_code()
@@ -6257,7 +5895,6 @@ def buy_item(item_id):
              (session['user_id'], item_id, purchase_code, 'pending'))
     
     conn.commit()
-    conn.close()
     
     return redirect(url_for('shop', success=f'✅ Товар "{item_name}" куплен!', code=purchase_code))
 
@@ -6266,27 +5903,25 @@ def profile():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     c.execute('SELECT full_name, username, faculty, group_name, phone, hours, coins, avatar FROM users WHERE id = ?', 
               (session['user_id'],))
     user = c.fetchone()
     
-    c.execute('''SELECT p.id, si.name, p.code, p.created_at
+    c.execute('''SELECT si.name, p.code, p.created_at
                  FROM purchases p
                  JOIN shop_items si ON p.item_id = si.id
                  WHERE p.user_id = ? AND p.status = 'pending'
                  ORDER BY p.created_at DESC''', (session['user_id'],))
     pending_purchases = c.fetchall()
     
-    conn.close()
-    
     if not user:
         return redirect(url_for('login'))
     
-    avatar_url = user[7] if user[7] else 'data:image/svg+xml,<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100"><circle cx="50" cy="50" r="50" fill="%23667eea"/><text x="50" y="50" font-size="40" fill="white" text-anchor="middle" dominant-baseline="central">👤</text></svg>'
+    avatar_url = user[7] or DEFAULT_AVATAR
     
-    return render_template_string(PROFILE_TEMPLATE,
+    return render_template('profile.html',
                                  full_name=user[0],
                                  username=user[1],
                                  faculty=user[2],
@@ -6310,22 +5945,12 @@ def update_avatar():
         return redirect(url_for('profile'))
     
     try:
-        image = Image.open(file.stream)
-        image = image.convert('RGB')
-        image.thumbnail((300, 300))
+        avatar_url = image_to_data_url(file, (300, 300))
         
-        buffer = io.BytesIO()
-        image.save(buffer, format='JPEG', quality=85)
-        buffer.seek(0)
-        
-        image_data = base64.b64encode(buffer.read()).decode('utf-8')
-        avatar_url = f'data:image/jpeg;base64,{image_data}'
-        
-        conn = sqlite3.connect('urban_community.db')
+        conn = get_db()
         c = conn.cursor()
         c.execute('UPDATE users SET avatar = ? WHERE id = ?', (avatar_url, session['user_id']))
         conn.commit()
-        conn.close()
     except Exception as e:
         print(f"Error updating avatar: {e}")
     
@@ -6343,36 +5968,36 @@ def creator_login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        hashed_password = hash_password(password)
         
-        conn = sqlite3.connect('urban_community.db')
+        conn = get_db()
         c = conn.cursor()
-        c.execute('SELECT id FROM event_creators WHERE username = ? AND password = ?',
-                  (username, hashed_password))
+        c.execute('SELECT id, password FROM event_creators WHERE username = ?', (username,))
         creator = c.fetchone()
-        conn.close()
         
-        if creator:
+        if verify_password(creator[1] if creator else None, password):
+            if is_legacy_hash(creator[1]):
+                c.execute('UPDATE event_creators SET password = ? WHERE id = ?',
+                          (hash_password(password), creator[0]))
+                conn.commit()
             session['creator_id'] = creator[0]
             return redirect(url_for('creator_dashboard'))
         else:
-            return render_template_string(CREATOR_LOGIN_TEMPLATE, error='❌ Неверный логин или пароль')
+            return render_template('creator_login.html', error='❌ Неверный логин или пароль')
     
-    return render_template_string(CREATOR_LOGIN_TEMPLATE)
+    return render_static_page('creator_login.html')
 
 @app.route('/creator/dashboard')
 def creator_dashboard():
     if 'creator_id' not in session:
         return redirect(url_for('creator_login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     c.execute('SELECT id, name, description, date, start_time, end_time, location, hours FROM events WHERE creator_id = ? ORDER BY created_at DESC',
               (session['creator_id'],))
     events = c.fetchall()
-    conn.close()
     
-    return render_template_string(CREATOR_DASHBOARD_TEMPLATE, events=events, success=request.args.get('success'))
+    return render_template('creator_dashboard.html', events=events, success=request.args.get('success'))
 
 @app.route('/creator/create-event', methods=['POST'])
 def create_event():
@@ -6391,13 +6016,12 @@ def create_event():
     
     event_date = f"{day.zfill(2)}.{month.zfill(2)}.{year}"
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     c.execute('''INSERT INTO events (name, description, date, start_time, end_time, location, hours, creator_id)
                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
               (name, description, event_date, start_time, end_time, location, hours, session['creator_id']))
     conn.commit()
-    conn.close()
     
     return redirect(url_for('creator_dashboard', success=f'✅ Мероприятие "{name}" создано!'))
 
@@ -6406,7 +6030,7 @@ def creator_event_detail(event_id):
     if 'creator_id' not in session:
         return redirect(url_for('creator_login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     c.execute('SELECT name, description, date, start_time, end_time, location, hours FROM events WHERE id = ? AND creator_id = ?', 
               (event_id, session['creator_id']))
@@ -6421,15 +6045,14 @@ def creator_event_detail(event_id):
     ''', (event_id,))
     registered_students = c.fetchall()
     
-    conn.close()
-    
     if not event:
         return "Event not found", 404
     
-    exit_code = generate_time_based_qr(event_id)
+    now = time.time()
+    exit_code = generate_time_based_qr(event_id, int(now // 60))
     qr_image = generate_qr_image(exit_code)
     
-    return render_template_string(EVENT_DETAIL_TEMPLATE,
+    return render_template('event_detail.html',
                                  event_id=event_id,
                                  event_name=event[0],
                                  description=event[1],
@@ -6440,6 +6063,7 @@ def creator_event_detail(event_id):
                                  hours=event[6],
                                  exit_code=exit_code,
                                  qr_image=qr_image,
+                                 expires_in=qr_expires_in(now),
                                  registered_students=registered_students,
                                  registered_count=len(registered_students),
                                  completed_count=len(registered_students),
@@ -6452,19 +6076,19 @@ def creator_logout():
 
 # =============== ADMIN ROUTES ===============
 
+ADMIN_ACCOUNTS = {
+    'yernur@': 'ernur140707',
+    'admin': 'admin123',
+}
+
 @app.route('/admin', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '').strip()
         
-        ADMIN_USERNAME = 'yernur@'
-        ADMIN_PASSWORD = 'ernur140707'
-        
-        is_valid = (
-            (username == ADMIN_USERNAME and password == ADMIN_PASSWORD) or
-            (username == 'admin' and password == 'admin123')
-        )
+        admin_password = ADMIN_ACCOUNTS.get(username)
+        is_valid = admin_password is not None and hmac.compare_digest(password.encode(), admin_password.encode())
         
         if is_valid:
             session.clear()
@@ -6472,19 +6096,19 @@ def admin_login():
             session.permanent = True
             return redirect(url_for('admin_dashboard'))
         else:
-            return render_template_string(ADMIN_LOGIN_TEMPLATE, error='❌ Неверный логин или пароль')
+            return render_template('admin_login.html', error='❌ Неверный логин или пароль')
     
-    return render_template_string(ADMIN_LOGIN_TEMPLATE)
+    return render_static_page('admin_login.html')
 
 @app.route('/admin/dashboard')
 def admin_dashboard():
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     
-    c.execute('SELECT id, name, image_data, price, description, quantity FROM shop_items ORDER BY created_at DESC')
+    c.execute('SELECT id, name, price, description, quantity FROM shop_items ORDER BY created_at DESC')
     shop_items = c.fetchall()
     
     c.execute('''SELECT p.id, si.name, p.code, u.full_name, u.phone, p.created_at
@@ -6495,9 +6119,7 @@ def admin_dashboard():
                  ORDER BY p.created_at DESC''')
     pending_purchases = c.fetchall()
     
-    conn.close()
-    
-    return render_template_string(ADMIN_DASHBOARD_TEMPLATE,
+    return render_template('admin_dashboard.html',
                                  shop_items=shop_items,
                                  pending_purchases=pending_purchases,
                                  pending_count=len(pending_purchases),
@@ -6513,12 +6135,11 @@ def create_creator():
     hashed_password = hash_password(password)
     
     try:
-        conn = sqlite3.connect('urban_community.db')
+        conn = get_db()
         c = conn.cursor()
         c.execute('INSERT INTO event_creators (username, password) VALUES (?, ?)',
                   (username, hashed_password))
         conn.commit()
-        conn.close()
         return redirect(url_for('admin_dashboard', success=f'✅ Создатель "{username}" добавлен!'))
     except sqlite3.IntegrityError:
         return redirect(url_for('admin_dashboard', success='❌ Этот логин уже занят'))
@@ -6541,23 +6162,13 @@ def add_shop_item():
         return redirect(url_for('admin_dashboard'))
     
     try:
-        image = Image.open(file.stream)
-        image = image.convert('RGB')
-        image.thumbnail((800, 800))
+        image_url = image_to_data_url(file, (800, 800))
         
-        buffer = io.BytesIO()
-        image.save(buffer, format='JPEG', quality=85)
-        buffer.seek(0)
-        
-        image_data = base64.b64encode(buffer.read()).decode('utf-8')
-        image_url = f'data:image/jpeg;base64,{image_data}'
-        
-        conn = sqlite3.connect('urban_community.db')
+        conn = get_db()
         c = conn.cursor()
         c.execute('INSERT INTO shop_items (name, image_data, price, description, quantity) VALUES (?, ?, ?, ?, ?)',
                  (name, image_url, price, description, quantity))
         conn.commit()
-        conn.close()
         
         return redirect(url_for('admin_dashboard', success=f'✅ Товар "{name}" добавлен!'))
     except Exception as e:
@@ -6569,11 +6180,10 @@ def delete_shop_item(item_id):
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     c.execute('DELETE FROM shop_items WHERE id = ?', (item_id,))
     conn.commit()
-    conn.close()
     
     return redirect(url_for('admin_dashboard', success='✅ Товар удален!'))
 
@@ -6582,11 +6192,10 @@ def complete_order(purchase_id):
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     c.execute('UPDATE purchases SET status = ? WHERE id = ?', ('completed', purchase_id))
     conn.commit()
-    conn.close()
     
     return redirect(url_for('admin_dashboard', success='✅ Заказ выполнен!'))
 
@@ -6595,17 +6204,17 @@ def cancel_order(purchase_id):
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     
-    c.execute('SELECT user_id, item_id FROM purchases WHERE id = ?', (purchase_id,))
+    c.execute('''SELECT p.user_id, p.item_id, si.price
+                 FROM purchases p
+                 JOIN shop_items si ON p.item_id = si.id
+                 WHERE p.id = ?''', (purchase_id,))
     purchase = c.fetchone()
     
     if purchase:
-        user_id, item_id = purchase
-        
-        c.execute('SELECT price FROM shop_items WHERE id = ?', (item_id,))
-        price = c.fetchone()[0]
+        user_id, item_id, price = purchase
         
         c.execute('UPDATE users SET coins = coins + ? WHERE id = ?', (price, user_id))
         c.execute('UPDATE shop_items SET quantity = quantity + 1 WHERE id = ?', (item_id,))
@@ -6613,50 +6222,34 @@ def cancel_order(purchase_id):
         
         conn.commit()
     
-    conn.close()
-    
     return redirect(url_for('admin_dashboard', success='✅ Заказ отменен, койны возвращены!'))
 
-@app.route('/admin/analytics')
-def admin_analytics():
-    if 'admin' not in session:
-        return redirect(url_for('admin_login'))
-    
-    conn = sqlite3.connect('urban_community.db')
-    c = conn.cursor()
-    
-    # Total statistics
-    c.execute('SELECT COUNT(*) FROM users')
-    total_students = c.fetchone()[0]
+# Сводная статистика тяжелая (полные проходы по таблицам), а точность до секунды не нужна
+ANALYTICS_CACHE_TTL = 30
+_analytics_cache = {'expires_at': 0.0, 'stats': None}
+
+def load_analytics_stats(c):
+    """Подсчет всей статистики для страницы аналитики"""
+    # Total statistics: one aggregate query per table
+    c.execute('SELECT COUNT(*), SUM(coins), AVG(coins) FROM users')
+    total_students, total_coins_circulation, avg_coins = c.fetchone()
+    total_coins_circulation = total_coins_circulation or 0
+    avg_coins = int(avg_coins or 0)
     
     c.execute('SELECT COUNT(*) FROM events')
     total_events = c.fetchone()[0]
     
-    c.execute('SELECT COUNT(*) FROM scans')
-    total_scans = c.fetchone()[0]
+    # Scans, active students (who have at least 1 scan) and coins issued
+    c.execute('SELECT COUNT(*), COUNT(DISTINCT user_id), SUM(coins_earned) FROM scans')
+    total_scans, active_students, total_coins_issued = c.fetchone()
+    total_coins_issued = total_coins_issued or 0
     
-    c.execute('SELECT COUNT(*) FROM purchases')
-    total_purchases = c.fetchone()[0]
-    
-    # Active students (who have at least 1 scan)
-    c.execute('SELECT COUNT(DISTINCT user_id) FROM scans')
-    active_students = c.fetchone()[0]
+    c.execute('SELECT COUNT(*), SUM(si.price) FROM purchases p LEFT JOIN shop_items si ON p.item_id = si.id')
+    total_purchases, total_coins_spent = c.fetchone()
+    total_coins_spent = total_coins_spent or 0
     
     activity_percent = int((active_students / total_students * 100)) if total_students > 0 else 0
     
-    # Coins statistics
-    c.execute('SELECT SUM(coins_earned) FROM scans')
-    total_coins_issued = c.fetchone()[0] or 0
-    
-    c.execute('SELECT SUM(si.price) FROM purchases p JOIN shop_items si ON p.item_id = si.id')
-    total_coins_spent = c.fetchone()[0] or 0
-    
-    c.execute('SELECT SUM(coins) FROM users')
-    total_coins_circulation = c.fetchone()[0] or 0
-    
-    c.execute('SELECT AVG(coins) FROM users')
-    avg_coins = int(c.fetchone()[0] or 0)
-    
     # Top 10 students
     c.execute('''SELECT u.id, u.full_name, u.faculty, u.hours, u.coins, COUNT(s.id) as scan_count
                  FROM users u
@@ -6675,36 +6268,45 @@ def admin_analytics():
                  LIMIT 10''')
     popular_events = c.fetchall()
     
-    conn.close()
+    return {
+        'total_students': total_students,
+        'total_events': total_events,
+        'total_scans': total_scans,
+        'total_purchases': total_purchases,
+        'active_students': active_students,
+        'activity_percent': activity_percent,
+        'total_coins_issued': total_coins_issued,
+        'total_coins_spent': total_coins_spent,
+        'total_coins_circulation': total_coins_circulation,
+        'avg_coins': avg_coins,
+        'top_students': top_students,
+        'popular_events': popular_events,
+    }
+
+@app.route('/admin/analytics')
+def admin_analytics():
+    if 'admin' not in session:
+        return redirect(url_for('admin_login'))
     
-    return render_template_string(ANALYTICS_TEMPLATE,
-                                 total_students=total_students,
-                                 total_events=total_events,
-                                 total_scans=total_scans,
-                                 total_purchases=total_purchases,
-                                 active_students=active_students,
-                                 activity_percent=activity_percent,
-                                 total_coins_issued=total_coins_issued,
-                                 total_coins_spent=total_coins_spent,
-                                 total_coins_circulation=total_coins_circulation,
-                                 avg_coins=avg_coins,
-                                 top_students=top_students,
-                                 popular_events=popular_events,
-                                 enumerate=enumerate)
+    now = time.monotonic()
+    if _analytics_cache['expires_at'] <= now:
+        _analytics_cache['stats'] = load_analytics_stats(get_db().cursor())
+        _analytics_cache['expires_at'] = now + ANALYTICS_CACHE_TTL
+    
+    return render_template('analytics.html', **_analytics_cache['stats'])
 
 @app.route('/admin/students')
 def admin_students():
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     
+    # Пользователи читаются в порядке индекса по имени, число сканов считается по индексу scans
     c.execute('''SELECT u.id, u.full_name, u.username, u.faculty, u.group_name, u.hours, u.coins, 
-                 COUNT(s.id) as scan_count
+                 (SELECT COUNT(*) FROM scans s WHERE s.user_id = u.id) as scan_count
                  FROM users u
-                 LEFT JOIN scans s ON u.id = s.user_id
-                 GROUP BY u.id
                  ORDER BY u.full_name''')
     students = c.fetchall()
     
@@ -6714,9 +6316,7 @@ def admin_students():
     c.execute('SELECT DISTINCT group_name FROM users ORDER BY group_name')
     groups = [row[0] for row in c.fetchall()]
     
-    conn.close()
-    
-    return render_template_string(STUDENTS_LIST_TEMPLATE,
+    return render_template('students_list.html',
                                  students=students,
                                  total_students=len(students),
                                  faculties=faculties,
@@ -6727,7 +6327,7 @@ def admin_student_profile(student_id):
     if 'admin' not in session:
         return redirect(url_for('admin_login'))
     
-    conn = sqlite3.connect('urban_community.db')
+    conn = get_db()
     c = conn.cursor()
     
     c.execute('SELECT id, full_name, username, faculty, group_name, phone, hours, coins, created_at, avatar FROM users WHERE id = ?', 
@@ -6735,7 +6335,6 @@ def admin_student_profile(student_id):
     student = c.fetchone()
     
     if not student:
-        conn.close()
         return "Student not found", 404
     
     c.execute('''SELECT e.name, s.exit_time, s.hours_earned, s.coins_earned
@@ -6745,27 +6344,21 @@ def admin_student_profile(student_id):
                  ORDER BY s.exit_time DESC''', (student_id,))
     scans = c.fetchall()
     
-    c.execute('''SELECT si.name, p.code, p.status, p.created_at
+    c.execute('''SELECT si.name, p.code, p.status, p.created_at, si.price
                  FROM purchases p
                  JOIN shop_items si ON p.item_id = si.id
                  WHERE p.user_id = ?
                  ORDER BY p.created_at DESC''', (student_id,))
     purchases = c.fetchall()
     
-    c.execute('SELECT COUNT(*) FROM scans WHERE user_id = ?', (student_id,))
-    total_events = c.fetchone()[0]
-    
-    c.execute('SELECT COUNT(*) FROM purchases WHERE user_id = ?', (student_id,))
-    total_purchases = c.fetchone()[0]
-    
-    c.execute('SELECT SUM(si.price) FROM purchases p JOIN shop_items si ON p.item_id = si.id WHERE p.user_id = ?', (student_id,))
-    coins_spent = c.fetchone()[0] or 0
+    # Счетчики берем из уже загруженных списков вместо отдельных COUNT/SUM запросов
+    total_events = len(scans)
+    total_purchases = len(purchases)
+    coins_spent = sum(purchase[4] for purchase in purchases)
     
-    conn.close()
-    
-    avatar_url = student[9] if student[9] else 'data:image/svg+xml,<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100"><circle cx="50" cy="50" r="50" fill="%23667eea"/><text x="50" y="50" font-size="40" fill="white" text-anchor="middle" dominant-baseline="central">👤</text></svg>'
+    avatar_url = student[9] or DEFAULT_AVATAR
     
-    return render_template_string(STUDENT_PROFILE_TEMPLATE,
+    return render_template('student_profile.html',
                                  student=student,
                                  avatar_url=avatar_url,
                                  scans=scans,
@@ -6779,22 +6372,81 @@ def admin_logout():
     session.pop('admin', None)
     return redirect(url_for('admin_login'))
 
+# =============== STATIC ASSETS ===============
+
+@app.route('/assets/<filename>')
+def asset(filename):
+    if filename not in STATIC_ASSETS:
+        return "Not found", 404
+    
+    content, compressed, mimetype = STATIC_ASSETS[filename]
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = app.response_class(compressed, mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = app.response_class(content, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
 # =============== API ROUTES ===============
 
 @app.route('/api/refresh-qr/<int:event_id>')
 def refresh_qr(event_id):
-    exit_code = generate_time_based_qr(event_id)
+    # Проверка сессии и владельца до генерации кода и картинки: код выхода видит только организатор
+    if 'creator_id' not in session:
+        return "Unauthorized", 401
+    
+    c = get_db().cursor()
+    c.execute('SELECT 1 FROM events WHERE id = ? AND creator_id = ?', (event_id, session['creator_id']))
+    if not c.fetchone():
+        return "Event not found", 404
+    
+    now = time.time()
+    exit_code = generate_time_based_qr(event_id, int(now // 60))
     qr_image = generate_qr_image(exit_code)
     return jsonify({
         'exit_code': exit_code,
-        'qr_image': qr_image
+        'qr_image': qr_image,
+        'expires_in': qr_expires_in(now)
     })
 
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'application/javascript', 'application/json'}
+COMPRESS_MIN_SIZE = 1000
+
+@app.after_request
+def compress_response(response):
+    """Gzip для HTML/JSON ответов, если клиент его поддерживает"""
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return response
+    
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    return f"Файл слишком большой: максимум {MAX_UPLOAD_SIZE // (1024 * 1024)} МБ", 413
+
 # =============== MAIN ===============
 
+# Схема создаётся при импорте, чтобы её видели и воркеры gunicorn
+# (с --preload это происходит один раз в мастер-процессе)
+init_db()
+
 if __name__ == '__main__':
-    init_db()
     print("=" * 60)
     print("🎓 Urban collage Platform")
     print("   Админ: yernur@ / ernur140707")
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    socketio.run(app, debug=os.environ.get('URBAN_DEBUG', '1') == '1',
+                 host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file